@@ -6,14 +6,50 @@ a clean CLI interface for torrent operations. SSH tunneling is handled
 by Ansible, not this script.
 """
 
+import argparse
+import base64
 import json
 import re
 import sys
+import threading
 import time
-from dataclasses import dataclass
-from typing import Dict, Any, List, Optional
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Sequence, Tuple
 
 import aria2p
+import requests
+import websocket
+from requests.adapters import HTTPAdapter
+
+# Only the fields TorrentStatus needs - avoids pulling peers, bitfields etc.
+_STATUS_KEYS: List[str] = [
+    "gid",
+    "status",
+    "totalLength",
+    "completedLength",
+    "downloadSpeed",
+    "errorMessage",
+    "bittorrent",
+    "files",
+]
+
+_MAGNET_PREFIX = "magnet:?xt=urn:btih:"
+_HEX_HASH_END = len(_MAGNET_PREFIX) + 40
+_MIN_MAGNET_LENGTH = len(_MAGNET_PREFIX) + 32  # Base32 infohash
+_HEX_DIGITS = b"0123456789abcdefABCDEF"
+
+# Hex (v1) or base32 infohash, followed by more parameters or the end
+_MAGNET_RE = re.compile(
+    r"^magnet:\?xt=urn:btih:(?:[a-fA-F0-9]{40}|[A-Z2-7]{32})(?:&|\Z)"
+)
+
+_STOPPED_STATES = frozenset({"complete", "error", "removed"})
+
+# Completion polling backoff, in seconds
+_POLL_INITIAL_SECONDS: float = 1.0
+_POLL_MAX_SECONDS: float = 15.0
+_POLL_BACKOFF_FACTOR: float = 1.5
 
 
 @dataclass(frozen=True)
@@ -24,6 +60,42 @@ class Aria2Config:
     download_dir: str = "~/downloads"
 
 
+@dataclass(frozen=True)
+class DownloadOptions:
+    """Immutable per-download aria2 options sent with the add call.
+
+    Unset (None) options are not sent, leaving the daemon's own config.
+    """
+
+    split: Optional[int] = None
+    max_connection_per_server: Optional[int] = None
+    min_split_size: Optional[str] = None
+    piece_length: Optional[str] = None
+    bt_max_peers: Optional[int] = None
+    bt_request_peer_speed_limit: Optional[str] = None
+    bt_tracker_connect_timeout: Optional[int] = None
+    bt_tracker_timeout: Optional[int] = None
+
+    def to_aria2(self, download_dir: Optional[str] = None) -> Dict[str, str]:
+        """Build the aria2 options struct (aria2 expects string values)."""
+        values = {
+            "split": self.split,
+            "max-connection-per-server": self.max_connection_per_server,
+            "min-split-size": self.min_split_size,
+            "piece-length": self.piece_length,
+            "bt-max-peers": self.bt_max_peers,
+            "bt-request-peer-speed-limit": self.bt_request_peer_speed_limit,
+            "bt-tracker-connect-timeout": self.bt_tracker_connect_timeout,
+            "bt-tracker-timeout": self.bt_tracker_timeout,
+        }
+        options = {
+            name: str(value) for name, value in values.items() if value is not None
+        }
+        if download_dir:
+            options["dir"] = download_dir
+        return options
+
+
 @dataclass(frozen=True)
 class TorrentStatus:
     """Immutable torrent status information - matches rtorrent_client interface."""
@@ -36,21 +108,58 @@ class TorrentStatus:
     is_complete: bool
     is_active: bool
     error_message: Optional[str]
+    progress_percent: float = field(init=False, compare=False)
+
+    def __post_init__(self) -> None:
+        """Calculate download progress as percentage once, at construction."""
+        progress = 0.0
+        if self.size_bytes != 0:
+            progress = (self.completed_bytes / self.size_bytes) * 100.0
+        object.__setattr__(self, "progress_percent", progress)
+
+
+@dataclass(frozen=True)
+class DownloadSnapshot:
+    """Immutable status and file list taken from a single tellStatus call."""
 
-    @property
-    def progress_percent(self) -> float:
-        """Calculate download progress as percentage."""
-        if self.size_bytes == 0:
-            return 0.0
-        return (self.completed_bytes / self.size_bytes) * 100.0
+    status: TorrentStatus
+    files: Tuple[str, ...]
+
+
+class _SessionClient(aria2p.Client):
+    """aria2p client that reuses one keep-alive HTTP connection for all calls."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._session = requests.Session()
+        # One daemon, one connection; failures surface instead of retrying
+        self._session.mount(
+            "http://",
+            HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0),
+        )
+
+    def post(self, payload: str) -> dict:
+        """Send a JSON-RPC payload over the shared session."""
+        response = self._session.post(self.server, data=payload, timeout=self.timeout)
+        return response.json()
+
+    def close(self) -> None:
+        """Close the pooled HTTP connection."""
+        self._session.close()
 
 
 class Aria2Client:
     """Simple aria2 client that connects to localhost (SSH tunnel managed by Ansible)."""
 
-    def __init__(self, port: int = 6800) -> None:
+    def __init__(self, port: int = 6800, *, probe: bool = False) -> None:
         self._port = port
+        self._probe = probe
         self._api: Optional[aria2p.API] = None
+        # Magnet metadata GID -> GID of the file download that followed it
+        self._gid_aliases: Dict[str, str] = {}
+        # Set by aria2 WebSocket notifications to cut completion polling short
+        self._wakeup = threading.Event()
+        self._listener: Optional[threading.Thread] = None
 
     def __enter__(self) -> "Aria2Client":
         return self
@@ -61,19 +170,29 @@ class Aria2Client:
     def connect(self) -> None:
         """Connect to aria2 daemon via localhost (SSH tunnel assumed established)."""
         # Create aria2p API client - Ansible handles SSH tunnel
-        client = aria2p.Client(
+        client = _SessionClient(
             host="http://127.0.0.1", port=self._port, secret="changeme123"
         )
         self._api = aria2p.API(client)
 
-        # Test connection
-        self._api.get_global_options()
+        # Optional liveness check - otherwise the first real call surfaces errors
+        if self._probe:
+            self._api.get_global_options()
 
     def disconnect(self) -> None:
         """Clean up API connection."""
+        if self._api:
+            self._api.client.stop_listening()
+            self._api.client.close()
         self._api = None
+        self._listener = None
 
-    def add_torrent(self, magnet_link: str, download_dir: Optional[str] = None) -> str:
+    def add_torrent(
+        self,
+        magnet_link: str,
+        download_dir: Optional[str] = None,
+        options: Optional[DownloadOptions] = None,
+    ) -> str:
         """Add torrent from magnet link and return GID."""
         if not self._validate_magnet_link(magnet_link):
             raise ValueError("Invalid magnet link format")
@@ -81,82 +200,74 @@ class Aria2Client:
         if not self._api:
             raise RuntimeError("Not connected to aria2")
 
-        # Add magnet link - aria2p handles the complexity
-        download = self._api.add_magnet(magnet_link)
-        return download.gid
+        # Single aria2.addUri call - directory and any tuning ride along
+        options = options or DownloadOptions()
+        return self._api.client.add_uri(
+            [magnet_link], options=options.to_aria2(download_dir)
+        )
 
     def add_torrent_file(
-        self, torrent_file: str, download_dir: Optional[str] = None
+        self,
+        torrent_file: str,
+        download_dir: Optional[str] = None,
+        options: Optional[DownloadOptions] = None,
     ) -> str:
         """Add torrent from .torrent file and return GID."""
         if not self._api:
             raise RuntimeError("Not connected to aria2")
 
-        # Add torrent file - aria2p handles the complexity
-        download = self._api.add_torrent(torrent_file)
-        return download.gid
+        options = options or DownloadOptions()
+        encoded = base64.b64encode(Path(torrent_file).read_bytes()).decode("ascii")
+        return self._api.client.add_torrent(
+            encoded, [], options=options.to_aria2(download_dir)
+        )
 
     def get_status(self, torrent_gid: str) -> TorrentStatus:
         """Get current status of torrent."""
         if not self._api:
             raise RuntimeError("Not connected to aria2")
 
-        all_downloads = self._api.get_downloads()
-
-        # First try to find a completed non-metadata download (for magnet links)
-        for d in all_downloads:
-            if d.is_complete and not d.is_metadata:
-                d.update()
-                return TorrentStatus(
-                    hash=d.gid,  # Use GID as hash equivalent
-                    name=d.name or "",
-                    size_bytes=d.total_length,
-                    completed_bytes=d.completed_length,
-                    download_rate=d.download_speed,
-                    is_complete=d.is_complete,
-                    is_active=d.is_active,
-                    error_message=d.error_message if d.has_failed else None,
-                )
-
-        # Fallback: find download by original GID
-        for d in all_downloads:
-            if d.gid == torrent_gid:
-                d.update()
-                return TorrentStatus(
-                    hash=d.gid,  # Use GID as hash equivalent
-                    name=d.name or "",
-                    size_bytes=d.total_length,
-                    completed_bytes=d.completed_length,
-                    download_rate=d.download_speed,
-                    is_complete=d.is_complete,
-                    is_active=d.is_active,
-                    error_message=d.error_message if d.has_failed else None,
-                )
-
-        raise RuntimeError(f"Torrent with GID {torrent_gid} not found")
+        struct = self._tell_followed(torrent_gid, _STATUS_KEYS)
+        return _status_from_struct(struct)
 
     def wait_for_completion(self, torrent_gid: str, timeout: int = 3600) -> bool:
-        """Wait for torrent to complete download."""
+        """Wait for torrent to complete download.
+
+        Polls with exponential backoff; aria2 completion and error
+        notifications wake the loop early so it re-polls immediately.
+        """
         if not self._api:
             raise RuntimeError("Not connected to aria2")
 
-        start_time = time.time()
-
-        while time.time() - start_time < timeout:
-            # Get all downloads to find the actual file download (not metadata)
-            all_downloads = self._api.get_downloads()
-
-            # For magnet links, aria2 creates multiple downloads
-            # Find the one that's complete and not metadata
-            for download in all_downloads:
-                if download.has_failed:
-                    raise RuntimeError(f"Download failed: {download.error_message}")
-
-                # Check if this is the actual file download (not metadata)
-                if download.is_complete and not download.is_metadata:
-                    return True
-
-            time.sleep(5)  # Check every 5 seconds
+        self._start_listener()
+        deadline = time.monotonic() + timeout
+        delay = _POLL_INITIAL_SECONDS
+        gid = self._resolve(torrent_gid)
+
+        while True:
+            self._wakeup.clear()
+            struct = self._api.client.tell_status(
+                gid, keys=["status", "errorMessage", "followedBy"]
+            )
+            if struct["status"] == "error":
+                raise RuntimeError(f"Download failed: {struct.get('errorMessage')}")
+            if struct["status"] == "removed":
+                raise RuntimeError(f"Download {gid} was removed")
+
+            # Magnet metadata is done - keep waiting on the actual file download
+            if struct.get("followedBy"):
+                gid = struct["followedBy"][0]
+                self._gid_aliases[torrent_gid] = gid
+                continue
+
+            if struct["status"] == "complete":
+                return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._wakeup.wait(min(delay, remaining))
+            delay = min(_POLL_MAX_SECONDS, delay * _POLL_BACKOFF_FACTOR)
 
         raise TimeoutError(f"Torrent not completed within {timeout} seconds")
 
@@ -165,43 +276,146 @@ class Aria2Client:
         if not self._api:
             raise RuntimeError("Not connected to aria2")
 
-        # For magnet links, find the completed non-metadata download
-        all_downloads = self._api.get_downloads()
-        for download in all_downloads:
-            if download.is_complete and not download.is_metadata and download.files:
-                return [str(f.path) for f in download.files]
+        struct = self._tell_followed(torrent_gid, ["files"])
+        return _paths_from_struct(struct)
 
-        # Fallback: try to find by GID
-        for download in all_downloads:
-            if download.gid == torrent_gid and download.files:
-                return [str(f.path) for f in download.files]
+    def get_download_snapshot(self, torrent_gid: str) -> DownloadSnapshot:
+        """Get status and files of torrent in one round-trip."""
+        if not self._api:
+            raise RuntimeError("Not connected to aria2")
 
-        return []
+        struct = self._tell_followed(torrent_gid, _STATUS_KEYS)
+        return DownloadSnapshot(
+            status=_status_from_struct(struct),
+            files=tuple(_paths_from_struct(struct)),
+        )
 
     def remove_torrent(self, torrent_gid: str, delete_files: bool = False) -> None:
         """Remove torrent from aria2."""
         if not self._api:
             raise RuntimeError("Not connected to aria2")
 
-        # Find download by GID
-        download = None
-        for d in self._api.get_downloads():
-            if d.gid == torrent_gid:
-                download = d
-                break
+        client = self._api.client
+        struct = client.tell_status(torrent_gid, keys=["status", "followedBy"])
 
-        if download:
-            download.remove(force=delete_files)
+        # Magnet links: also remove the file download that followed the metadata
+        followed_gids = struct.get("followedBy", [])
+        followed = self._multicall(
+            [(client.TELL_STATUS, [gid, ["status"]]) for gid in followed_gids]
+        )
+
+        removals = [
+            _remove_call(gid, f["status"], delete_files)
+            for gid, f in zip(followed_gids, followed)
+        ]
+        removals.append(_remove_call(torrent_gid, struct["status"], delete_files))
+        self._multicall(removals)
+        self._gid_aliases.pop(torrent_gid, None)
+
+    def _multicall(self, calls: List[Tuple[str, List[Any]]]) -> List[Any]:
+        """Run aria2 methods in one system.multicall request, failing on any fault."""
+        if not calls:
+            return []
+
+        results = []
+        for result in self._api.client.multicall2(calls):
+            # Each call yields a one-element list on success or a fault struct
+            if isinstance(result, dict):
+                raise aria2p.ClientException(result["code"], result["message"])
+            results.append(result[0])
+        return results
+
+    def _start_listener(self) -> None:
+        """Listen for aria2 WebSocket notifications in a background thread.
+
+        Notifications only shorten the wait between polls, so a daemon that
+        refuses the WebSocket leaves plain backoff polling in place.
+        """
+        if self._listener:
+            return
+
+        self._listener = threading.Thread(
+            target=self._listen_for_notifications, daemon=True
+        )
+        self._listener.start()
+
+    def _listen_for_notifications(self) -> None:
+        """Run aria2p's notification loop until the WebSocket goes away."""
+        try:
+            self._api.client.listen_to_notifications(
+                on_download_complete=self._on_notification,
+                on_download_error=self._on_notification,
+                handle_signals=False,
+            )
+        except (websocket.WebSocketException, OSError):
+            # aria2p only handles refused/reset connections itself; any other
+            # handshake failure leaves wait_for_completion on backoff polling
+            pass
+
+    def _on_notification(self, gid: str) -> None:
+        """Wake wait_for_completion to re-poll status."""
+        self._wakeup.set()
+
+    def _resolve(self, torrent_gid: str) -> str:
+        """Return the GID of the file download for torrent_gid, if already known."""
+        return self._gid_aliases.get(torrent_gid, torrent_gid)
+
+    def _tell_followed(self, torrent_gid: str, keys: List[str]) -> Dict[str, Any]:
+        """Fetch status fields, switching to the follow-up download of a magnet link.
+
+        aria2 downloads magnet metadata under the original GID and then starts
+        the actual file download under a new GID listed in ``followedBy``.
+        Once seen, the mapping is remembered so later calls need one request.
+        """
+        gid = self._resolve(torrent_gid)
+        if gid != torrent_gid:
+            return self._api.client.tell_status(gid, keys=keys)
+
+        struct = self._api.client.tell_status(torrent_gid, keys=keys + ["followedBy"])
+        followed_by = struct.get("followedBy")
+        if followed_by:
+            self._gid_aliases[torrent_gid] = followed_by[0]
+            struct = self._api.client.tell_status(followed_by[0], keys=keys)
+        return struct
 
     def _validate_magnet_link(self, magnet_link: str) -> bool:
         """Validate magnet link format."""
-        return bool(re.match(r"^magnet:\?xt=urn:btih:[a-fA-F0-9]{40}", magnet_link))
-
-
-def main():
-    """CLI entry point for Ansible script execution."""
-    import argparse
-
+        # Reject non-magnet input and truncated hashes without the regex engine
+        if len(magnet_link) < _MIN_MAGNET_LENGTH or not magnet_link.startswith(
+            _MAGNET_PREFIX
+        ):
+            return False
+
+        # Fast path for hex infohashes: deleting every hex digit must leave nothing
+        infohash = magnet_link[len(_MAGNET_PREFIX) : _HEX_HASH_END].encode(
+            "ascii", "replace"
+        )
+        if (
+            len(infohash) == 40
+            and not infohash.translate(None, _HEX_DIGITS)
+            and magnet_link[_HEX_HASH_END : _HEX_HASH_END + 1] in ("", "&")
+        ):
+            return True
+
+        # Base32 infohashes and malformed links go through the full pattern
+        return _MAGNET_RE.match(magnet_link) is not None
+
+
+# One flag per DownloadOptions field, named like the aria2 option it sets
+_DOWNLOAD_OPTION_FLAGS: Tuple[Tuple[str, type, str], ...] = (
+    ("--split", int, "Connections per download"),
+    ("--max-connection-per-server", int, "Maximum connections to one server"),
+    ("--min-split-size", str, "Minimum size of a split range, e.g. 1M"),
+    ("--piece-length", str, "HTTP/FTP piece length, e.g. 1M"),
+    ("--bt-max-peers", int, "Maximum BitTorrent peers per torrent"),
+    ("--bt-request-peer-speed-limit", str, "Speed below which to add peers"),
+    ("--bt-tracker-connect-timeout", int, "Tracker connect timeout in seconds"),
+    ("--bt-tracker-timeout", int, "Tracker response timeout in seconds"),
+)
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    """Parse CLI arguments (argv=None reads sys.argv)."""
     parser = argparse.ArgumentParser(description="aria2 JSON-RPC client operations")
     parser.add_argument(
         "action", choices=["add", "status", "wait", "files", "remove", "download"]
@@ -217,7 +431,8 @@ def main():
         "--torrent-hash", help="Torrent GID for status/wait/files/remove"
     )
     parser.add_argument(
-        "--download-dir", default="~/downloads", help="Download directory"
+        "--download-dir",
+        help="Download directory on the aria2 host (default: daemon's --dir)",
     )
     parser.add_argument(
         "--timeout", type=int, default=3600, help="Timeout for wait action"
@@ -225,18 +440,30 @@ def main():
     parser.add_argument(
         "--delete-files", action="store_true", help="Delete files when removing"
     )
+    # Per-download options; flags left unset keep the daemon's own settings
+    for flag, kind, help_text in _DOWNLOAD_OPTION_FLAGS:
+        parser.add_argument(flag, type=kind, help=help_text)
+    return parser.parse_args(argv)
 
-    args = parser.parse_args()
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """CLI entry point for Ansible script execution."""
+    args = parse_args(argv)
     result: Dict[str, Any] = {}
+    options = DownloadOptions(
+        **{opt.name: getattr(args, opt.name) for opt in fields(DownloadOptions)}
+    )
 
     with Aria2Client(port=args.port) as client:
         client.connect()
 
         if args.action == "add":
             if args.magnet_link:
-                gid = client.add_torrent(args.magnet_link, args.download_dir)
+                gid = client.add_torrent(args.magnet_link, args.download_dir, options)
             elif args.torrent_file:
-                gid = client.add_torrent_file(args.torrent_file, args.download_dir)
+                gid = client.add_torrent_file(
+                    args.torrent_file, args.download_dir, options
+                )
             else:
                 raise ValueError(
                     "Either --magnet-link or --torrent-file required for add action"
@@ -284,16 +511,19 @@ def main():
         elif args.action == "download":
             # Complete download workflow for Ansible - matches rtorrent interface
             if args.magnet_link:
-                gid = client.add_torrent(args.magnet_link, args.download_dir)
+                gid = client.add_torrent(args.magnet_link, args.download_dir, options)
             elif args.torrent_file:
-                gid = client.add_torrent_file(args.torrent_file, args.download_dir)
+                gid = client.add_torrent_file(
+                    args.torrent_file, args.download_dir, options
+                )
             else:
                 raise ValueError(
                     "Either --magnet-link or --torrent-file required for download action"
                 )
             client.wait_for_completion(gid, args.timeout)
-            final_status = client.get_status(gid)
-            files = client.get_files(gid)
+            snapshot = client.get_download_snapshot(gid)
+            final_status = snapshot.status
+            files = list(snapshot.files)
 
             result = {
                 "success": True,
@@ -323,5 +553,48 @@ def _status_to_dict(status: TorrentStatus) -> Dict[str, Any]:
     }
 
 
+def _status_from_struct(struct: Dict[str, Any]) -> TorrentStatus:
+    """Build TorrentStatus from an aria2.tellStatus response."""
+    status = struct["status"]
+    return TorrentStatus(
+        hash=struct["gid"],  # Use GID as hash equivalent
+        name=_download_name(struct),
+        size_bytes=int(struct["totalLength"]),
+        completed_bytes=int(struct["completedLength"]),
+        download_rate=int(struct["downloadSpeed"]),
+        is_complete=status == "complete",
+        is_active=status == "active",
+        error_message=struct.get("errorMessage") if status == "error" else None,
+    )
+
+
+def _download_name(struct: Dict[str, Any]) -> str:
+    """Torrent name from bittorrent info, falling back to the first file name."""
+    info = struct.get("bittorrent", {}).get("info")
+    if info:
+        return info["name"]
+
+    files = struct.get("files", [])
+    if files and files[0]["path"]:
+        return Path(files[0]["path"]).name
+
+    return ""
+
+
+def _remove_call(gid: str, status: str, delete_files: bool) -> Tuple[str, List[Any]]:
+    """aria2 method call that removes a download in the given status."""
+    # Stopped downloads only have a result left to clear
+    if status in _STOPPED_STATES:
+        return aria2p.Client.REMOVE_DOWNLOAD_RESULT, [gid]
+    if delete_files:
+        return aria2p.Client.FORCE_REMOVE, [gid]
+    return aria2p.Client.REMOVE, [gid]
+
+
+def _paths_from_struct(struct: Dict[str, Any]) -> List[str]:
+    """File paths from an aria2 status, skipping files without a path yet."""
+    return [f["path"] for f in struct.get("files", []) if f.get("path")]
+
+
 if __name__ == "__main__":
     main()
@@ -1,35 +1,55 @@
 """Test data generation for aria2_client testing."""
 
 import os
+import random
 import tempfile
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Sequence, Tuple
 
 import torf
 
+TEMP_DIR_PREFIX: str = "torrentp_test_"
+CHUNK_SIZE: int = 1024 * 1024  # 1MB write chunks
+SPARSE_STAMP_INTERVAL: int = 16 * 1024  # Smallest BitTorrent piece size
+SPARSE_STAMP_SIZE: int = 8
+TARGET_PIECE_COUNT: int = 1500
+MIN_PIECE_SIZE: int = 32 * 1024  # 32KB
+MAX_PIECE_SIZE: int = 4 * 1024 * 1024  # 4MB
 
-def create_test_torrent(size_mb: int = 40) -> Tuple[Path, str]:
-    """Create test file and torrent, return file path and magnet link.
+
+def create_test_torrent(
+    size_mb: int = 40,
+    seed: Optional[int] = None,
+    sparse: bool = False,
+    trackers: Sequence[str] = (),
+) -> Tuple[Path, torf.Torrent]:
+    """Create test file and torrent, return file path and generated torrent.
+
+    The .torrent file is written next to the test file with the same stem.
 
     Args:
         size_mb: Size of test file in megabytes
+        seed: Seed for the test file contents (None = random)
+        sparse: Create a mostly-unallocated file instead of writing every byte
+        trackers: Tracker announce URLs (empty = DHT-only)
 
     Returns:
-        Tuple of (test_file_path, magnet_link)
+        Tuple of (test_file_path, torrent)
     """
     # Create temporary directory for test files
-    temp_dir = Path(tempfile.mkdtemp(prefix="torrentp_test_"))
+    temp_dir = Path(tempfile.mkdtemp(prefix=TEMP_DIR_PREFIX))
 
     # Generate random test file
     test_file = temp_dir / f"test_file_{size_mb}mb.bin"
-    with open(test_file, "wb") as f:
-        f.write(os.urandom(size_mb * 1024 * 1024))
+    if sparse:
+        _write_sparse_file(test_file, size_mb, seed)
+    else:
+        _write_random_file(test_file, size_mb, seed)
 
-    # Create torrent with DHT (no trackers)
     torrent = torf.Torrent(
         path=test_file,
-        trackers=[],  # DHT-only
-        piece_size=32768,  # 32KB pieces
+        trackers=list(trackers),
+        piece_size=choose_piece_size(test_file.stat().st_size),
         comment=f"Test torrent for aria2_client - {size_mb}MB",
         private=False,  # Allow DHT
     )
@@ -41,10 +61,60 @@ def create_test_torrent(size_mb: int = 40) -> Tuple[Path, str]:
     torrent_file = temp_dir / f"test_file_{size_mb}mb.torrent"
     torrent.write(torrent_file)
 
-    # Get magnet link
-    magnet_link = torrent.magnet()
+    return test_file, torrent
+
+
+def choose_piece_size(size_bytes: int) -> int:
+    """Choose a power-of-two piece size giving roughly TARGET_PIECE_COUNT pieces.
+
+    Args:
+        size_bytes: Total size of the torrent content
+
+    Returns:
+        Piece size in bytes, clamped to [MIN_PIECE_SIZE, MAX_PIECE_SIZE]
+    """
+    target = max(1, size_bytes // TARGET_PIECE_COUNT)
+    piece_size = 1 << (target - 1).bit_length()  # Next power of two
+    return max(MIN_PIECE_SIZE, min(MAX_PIECE_SIZE, piece_size))
+
 
-    return test_file, str(magnet_link)
+def _write_random_file(path: Path, size_mb: int, seed: Optional[int]) -> None:
+    """Write pseudo-random data in chunks so memory use stays at one chunk.
+
+    Args:
+        path: File to create
+        size_mb: Size of file in megabytes
+        seed: PRNG seed (None = seeded from system entropy)
+    """
+    # Test data needs unique piece hashes, not cryptographic randomness
+    rng = random.Random(seed)
+    with open(path, "wb") as f:
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(f.fileno(), 0, size_mb * CHUNK_SIZE)
+        for _ in range(size_mb):
+            f.write(rng.randbytes(CHUNK_SIZE))
+
+
+def _write_sparse_file(path: Path, size_mb: int, seed: Optional[int]) -> None:
+    """Create a sparse file with a random stamp every 16KB.
+
+    Only the stamps are written, but they keep every piece hash distinct for
+    any piece size, so clients cannot collapse identical pieces.
+
+    Args:
+        path: File to create
+        size_mb: Size of file in megabytes
+        seed: PRNG seed (None = seeded from system entropy)
+    """
+    rng = random.Random(seed)
+    size = size_mb * CHUNK_SIZE
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        for offset in range(0, size, SPARSE_STAMP_INTERVAL):
+            os.pwrite(fd, rng.randbytes(SPARSE_STAMP_SIZE), offset)
+    finally:
+        os.close(fd)
 
 
 def cleanup_test_data(test_file_path: Path) -> None:
@@ -57,5 +127,5 @@ def cleanup_test_data(test_file_path: Path) -> None:
 
     # Remove entire temporary directory
     temp_dir = test_file_path.parent
-    if temp_dir.exists() and "torrentp_test_" in temp_dir.name:
+    if temp_dir.exists() and TEMP_DIR_PREFIX in temp_dir.name:
         shutil.rmtree(temp_dir, ignore_errors=True)
@@ -9,7 +9,7 @@ import asyncio
 import sys
 import time
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 
 try:
     import libtorrent as lt
@@ -27,7 +27,9 @@ except ImportError:
 
 import torf
 
-from test_data import create_test_torrent, cleanup_test_data
+from test_data import choose_piece_size, create_test_torrent, cleanup_test_data
+
+STATUS_LOG_INTERVAL_SECONDS: int = 30
 
 
 class TorrentSeeder:
@@ -55,6 +57,8 @@ class TorrentSeeder:
         self.session: Optional[lt.session] = None
         self.handle: Optional[lt.torrent_handle] = None
         self.tracker: Optional[TrackerServer] = None
+        self._stop_event = asyncio.Event()
+        self._alert_event = asyncio.Event()
 
     async def start(self) -> None:
         """Start the seeder and local tracker."""
@@ -66,10 +70,8 @@ class TorrentSeeder:
         self.tracker = TrackerServer(
             local_addr=("127.0.0.1", self.tracker_port), loop=loop
         )
-        asyncio.ensure_future(self.tracker.start())
-
-        # Give tracker time to start
-        await asyncio.sleep(1)
+        # start() returns once the UDP socket is bound; bind errors propagate
+        await self.tracker.start()
 
         # Create session with default settings
         self.session = lt.session()
@@ -80,28 +82,34 @@ class TorrentSeeder:
         # Enable DHT (but we'll primarily use local tracker)
         self.session.start_dht()
 
-        # Load torrent
-        with open(self.torrent_file, "rb") as f:
-            torrent_data = f.read()
+        # Only state changes raise alerts; libtorrent's notify callback runs on
+        # its own thread, so hand the wake-up to the event loop
+        self.session.apply_settings(
+            {"alert_mask": lt.alert.category_t.status_notification}
+        )
+        self.session.set_alert_notify(
+            lambda: loop.call_soon_threadsafe(self._alert_event.set)
+        )
 
-        torrent_info = lt.torrent_info(torrent_data)
+        # Load torrent - libtorrent reads the file itself, no Python-side copy
+        torrent_info = lt.torrent_info(str(self.torrent_file))
 
         # Add torrent for seeding
         add_params = {
             "ti": torrent_info,
             "save_path": str(self.data_dir),
-            "flags": lt.add_torrent_params_flags_t.flag_seed_mode,  # Seed mode
+            # Seed mode: pieces are verified lazily as peers request them, so
+            # the payload is not hashed a second time before seeding starts
+            "flags": lt.add_torrent_params_flags_t.flag_seed_mode,
         }
 
         self.handle = self.session.add_torrent(add_params)
         print(f"Added torrent: {torrent_info.name()}")
         print(f"Info hash: {torrent_info.info_hash()}")
 
-        # Force recheck to verify we have the file
-        self.handle.force_recheck()
-
     async def stop(self) -> None:
         """Stop the seeder and tracker."""
+        self._stop_event.set()
         if self.handle:
             self.session.remove_torrent(self.handle)
         if self.session:
@@ -130,34 +138,57 @@ class TorrentSeeder:
         """Seed for specified duration.
 
         Args:
-            duration_seconds: How long to seed (None = forever)
+            duration_seconds: How long to seed (None = until stop() is called)
         """
         print("Seeding started...")
-        start_time = time.time()
+        status_logger = asyncio.ensure_future(self._log_status())
 
         try:
-            while True:
-                status = self.get_status()
-                elapsed = time.time() - start_time
-
-                print(
-                    f"[{elapsed:.0f}s] Status: {status['status']} | "
-                    f"Peers: {status['num_peers']} | "
-                    f"Upload: {status['upload_rate'] / 1024:.1f} KB/s | "
-                    f"Uploaded: {status['total_uploaded'] / 1024 / 1024:.1f} MB"
-                )
-
-                if duration_seconds and elapsed >= duration_seconds:
-                    print(f"Seeding completed after {duration_seconds} seconds")
-                    break
-
-                await asyncio.sleep(5)
-
+            await asyncio.wait_for(self._stop_event.wait(), duration_seconds)
+        except asyncio.TimeoutError:
+            print(f"Seeding completed after {duration_seconds} seconds")
         except KeyboardInterrupt:
-            print("\\nSeeding stopped by user")
+            print("\nSeeding stopped by user")
+        finally:
+            status_logger.cancel()
 
+    async def _log_status(self) -> None:
+        """Print seeder status when it changes.
+
+        Wakes on libtorrent state-change alerts, and otherwise every
+        STATUS_LOG_INTERVAL_SECONDS to report upload progress if any was made.
+        """
+        start_time = time.monotonic()
+        last_uploaded: Optional[int] = None
 
-def create_torrent_file(test_file: Path, tracker_port: int = 6889) -> Path:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._alert_event.wait(), STATUS_LOG_INTERVAL_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._alert_event.clear()
+
+            alerts = self.session.pop_alerts()
+            state_changed = any(isinstance(a, lt.state_changed_alert) for a in alerts)
+            status = self.get_status()
+            if not state_changed and status["total_uploaded"] == last_uploaded:
+                continue
+            last_uploaded = status["total_uploaded"]
+
+            elapsed = time.monotonic() - start_time
+            print(
+                f"[{elapsed:.0f}s] Status: {status['status']} | "
+                f"Peers: {status['num_peers']} | "
+                f"Upload: {status['upload_rate'] / 1024:.1f} KB/s | "
+                f"Uploaded: {status['total_uploaded'] / 1024 / 1024:.1f} MB"
+            )
+
+
+def create_torrent_file(
+    test_file: Path, tracker_port: int = 6889
+) -> Tuple[Path, torf.Torrent]:
     """Create .torrent file for the test file with local tracker.
 
     Args:
@@ -165,7 +196,7 @@ def create_torrent_file(test_file: Path, tracker_port: int = 6889) -> Path:
         tracker_port: Port of local tracker
 
     Returns:
-        Path to created .torrent file
+        Tuple of (path to created .torrent file, torrent)
     """
     torrent_file = test_file.with_suffix(".torrent")
 
@@ -175,7 +206,7 @@ def create_torrent_file(test_file: Path, tracker_port: int = 6889) -> Path:
     torrent = torf.Torrent(
         path=test_file,
         trackers=[f"udp://127.0.0.1:{tracker_port}/announce"],  # Local UDP tracker
-        piece_size=32768,  # 32KB pieces
+        piece_size=choose_piece_size(test_file.stat().st_size),
         private=False,  # Allow DHT as backup
         comment="Test torrent for aria2 testing with local tracker",
     )
@@ -183,7 +214,7 @@ def create_torrent_file(test_file: Path, tracker_port: int = 6889) -> Path:
     torrent.generate()
     torrent.write(torrent_file)
 
-    return torrent_file
+    return torrent_file, torrent
 
 
 async def main() -> None:
@@ -198,9 +229,19 @@ async def main() -> None:
     parser.add_argument(
         "--port", type=int, default=6881, help="BitTorrent listen port (default: 6881)"
     )
+    parser.add_argument(
+        "--tracker-port",
+        type=int,
+        help="Local UDP tracker port (default: --port + 8)",
+    )
     parser.add_argument(
         "--keep-files", action="store_true", help="Keep test files after seeding"
     )
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Create a sparse test file (fast, for tests that ignore content)",
+    )
     parser.add_argument(
         "--existing-file",
         type=Path,
@@ -214,6 +255,9 @@ async def main() -> None:
 
     args = parser.parse_args()
 
+    # Default to port + 8 for tracker (e.g., 6881 + 8 = 6889)
+    tracker_port = args.tracker_port or args.port + 8
+
     if args.existing_file:
         # Use existing file
         test_file = args.existing_file
@@ -222,22 +266,20 @@ async def main() -> None:
             sys.exit(1)
         # Don't cleanup if using existing file
         cleanup = False
+        # Create torrent file with local tracker
+        torrent_file, torrent = create_torrent_file(test_file, tracker_port)
     else:
-        # Create new test file
+        # Create new test file, hashed once with the local tracker included
         print(f"Creating {args.size}MB test file...")
-        test_file, magnet_link = create_test_torrent(size_mb=args.size)
-        print(f"Magnet link: {magnet_link}")
+        test_file, torrent = create_test_torrent(
+            size_mb=args.size,
+            sparse=args.sparse,
+            trackers=[f"udp://127.0.0.1:{tracker_port}/announce"],
+        )
+        torrent_file = test_file.with_suffix(".torrent")
         cleanup = not args.keep_files
 
     try:
-        # Create torrent file with local tracker
-        tracker_port = args.port + 8  # Use port + 8 for tracker (e.g., 6881 + 8 = 6889)
-        torrent_file = create_torrent_file(test_file, tracker_port)
-
-        # Generate magnet link from torrent file
-        import torf
-
-        torrent = torf.Torrent.read(torrent_file)
         magnet_link = str(torrent.magnet())
 
         # Write magnet link to file if requested
@@ -246,7 +288,7 @@ async def main() -> None:
                 f.write(magnet_link)
             print(f"Magnet link written to: {args.magnet_file}")
 
-        print(f"\\nFile: {test_file}")
+        print(f"\nFile: {test_file}")
         print(f"Size: {test_file.stat().st_size / 1024 / 1024:.1f} MB")
         print(f"Torrent: {torrent_file}")
         print(f"Magnet: {magnet_link}")
@@ -264,15 +306,15 @@ async def main() -> None:
         if "seeder" in locals():
             await seeder.stop()
         if cleanup:
-            print("\\nCleaning up test files...")
+            print("\nCleaning up test files...")
             cleanup_test_data(test_file)
         else:
-            print(f"\\nTest files kept at: {test_file.parent}")
+            print(f"\nTest files kept at: {test_file.parent}")
 
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("\\nSeeder stopped by user")
+        print("\nSeeder stopped by user")
         sys.exit(0)
@@ -1,300 +1,995 @@
 """Test aria2_client.py CLI script functionality with real torrent downloads."""
 
-import json
+import asyncio
+import atexit
+import contextlib
+import io
+import logging
+import multiprocessing
+import operator
+import os
+import queue
+import re
 import shutil
-import subprocess
+import signal
+import socket
+import sys
 import tempfile
 import time
-from contextlib import contextmanager
-from dataclasses import dataclass
+import traceback
+from asyncio.subprocess import PIPE, STDOUT, Process
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, fields
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing.connection import Connection
 from pathlib import Path
-from typing import Generator, List, Tuple
-
+from types import MappingProxyType, SimpleNamespace
+from typing import (
+    Any,
+    AsyncGenerator,
+    Dict,
+    Generator,
+    Final,
+    FrozenSet,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import aria2p
+import orjson
 import pytest
-import torf
+import websocket
+
+from downpore_core.aria2_client import Aria2Client, DownloadOptions
+from downpore_core.aria2_client import main as aria2_client_main
+from downpore_core.aria2_client import parse_args
+from downpore_core.test_data import TEMP_DIR_PREFIX, choose_piece_size
 
 # Constants
 DEFAULT_CLI_TIMEOUT_SECONDS: int = 60
 CLI_PROCESS_TIMEOUT_SECONDS: int = 45
 SEEDER_READY_TIMEOUT_SECONDS: int = 10
-TEST_PORT: int = 6802
+# Seeder readiness plus the harness's CLI kill deadline (not the CLI's own
+# --timeout), with headroom for daemon startup, purge and teardown
+SLOW_TEST_TIMEOUT_SECONDS: int = (
+    SEEDER_READY_TIMEOUT_SECONDS + CLI_PROCESS_TIMEOUT_SECONDS + 20
+)
+SEEDER_READY_LINE: str = "Seeding started"
+# After the expected error is printed, how long a CLI gets to exit by itself
+# before it is killed and reported as -SIGKILL
+ERROR_EXIT_GRACE_SECONDS: float = 2.0
+# The raised error line, not the traceback's echo of the raise statement
+INVALID_MAGNET_ERROR: str = "ValueError: Invalid magnet link format"
+RPC_READY_ATTEMPTS: int = 40
+RPC_READY_INTERVAL_SECONDS: float = 0.05
 EXPECTED_FILE_SIZE: int = 40 * 1024 * 1024  # 40MB
-CLI_BASE_CMD: List[str] = [str(Path(__file__).parent.parent / "downpore_core" / "aria2_client.py"), "--port", str(TEST_PORT)]
+# Seeded payload plus one download per aria2 daemon, with room to spare
+TMPFS_FOOTPRINT_BYTES: int = 4 * EXPECTED_FILE_SIZE
+# tmpfs keeps the 40MB payload and its download in RAM instead of on disk, but
+# only when it is large enough (Docker's default /dev/shm is 64MB)
+TMPFS_DIR: Optional[str] = (
+    "/dev/shm"
+    if Path("/dev/shm").is_dir()
+    and shutil.disk_usage("/dev/shm").free >= TMPFS_FOOTPRINT_BYTES
+    else None
+)
+CLI_SUCCESS_FIELDS = operator.itemgetter(
+    "success", "torrent_hash", "files", "download_size", "download_complete"
+)
+PKG_DIR: Final[Path] = Path(__file__).resolve().parent.parent / "downpore_core"
+# Per-download tuning for a swarm of one local seeder: no peer speed
+# throttling and short tracker timeouts, passed to the CLI as flags
+SMALL_SWARM_OPTIONS: Final[DownloadOptions] = DownloadOptions(
+    split=16,
+    max_connection_per_server=16,
+    min_split_size="1M",
+    piece_length="1M",
+    bt_max_peers=128,
+    bt_request_peer_speed_limit="0",
+    bt_tracker_connect_timeout=5,
+    bt_tracker_timeout=5,
+)
+# Options every test daemon shares; see _build_aria2_command for the rest
+ARIA2_BASE_OPTIONS: Final[Mapping[str, str]] = MappingProxyType(
+    {
+        "enable-rpc": "true",
+        "seed-time": "0",  # Don't seed after download
+        "allow-overwrite": "true",
+        "split": "16",
+        "min-split-size": "1M",
+        "file-allocation": "none",  # No pre-write pass over the payload
+        "disk-cache": "0",  # Write pieces straight through
+        "optimize-concurrent-downloads": "true",
+        "max-concurrent-downloads": "5",
+        "bt-tracker-timeout": "5",
+        "follow-torrent": "true",  # Auto start file download after metadata
+        "bt-tracker-connect-timeout": "30",  # Longer tracker connect timeout
+    }
+)
+# Reads the CLI must never make: status, files and the magnet follow-up all
+# come from a single key-trimmed aria2.tellStatus per poll, so there is no
+# second per-poll call left for system.multicall to combine
+EXTRA_STATUS_RPC_METHODS: Final[FrozenSet[str]] = frozenset(
+    {
+        "aria2.tellActive",
+        "aria2.tellWaiting",
+        "aria2.tellStopped",
+        "aria2.getFiles",
+        "aria2.getPeers",
+        "aria2.getGlobalStat",
+    }
+)
+RPC_METHOD_RE = re.compile(rb'"method":\s*"([^"]+)"')
+CLI_SCRIPT: Final[str] = str(PKG_DIR / "aria2_client.py")
+SEEDER_SCRIPT: Final[str] = str(PKG_DIR / "test_seeder.py")
+# How _run_cli_command runs the CLI (DOWNPORE_CLI_RUNNER): "forkserver" forks
+# from an interpreter with the CLI already imported, "subprocess" spawns the
+# script. The connection-error test always spawns, so the script entry point
+# stays covered.
+CLI_RUNNERS: Final[Tuple[str, ...]] = ("forkserver", "subprocess")
+CLI_RUNNER: Final[str] = os.environ.get("DOWNPORE_CLI_RUNNER", "forkserver")
+if CLI_RUNNER not in CLI_RUNNERS:
+    raise ValueError(f"DOWNPORE_CLI_RUNNER must be one of {CLI_RUNNERS}")
+# posix_spawn needs inherited fds left alone (Python's own fds are already
+# non-inheritable) and an executable path rather than a bare name
+SPAWN_CLOSE_FDS: Final[bool] = False
+# CLI pointed at a port with no daemon behind it
+NO_DAEMON_CLI_CMD: Final[Tuple[str, ...]] = (
+    CLI_SCRIPT,
+    "--port",
+    "9999",
+    "download",
+    "--magnet-link",
+    "magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef01234567",
+)
+
+# Test directories are removed off the critical path; pending removals
+# finish before the interpreter exits
+_CLEANUP_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cleanup")
+atexit.register(_CLEANUP_POOL.shutdown, wait=True)
+
+# Forked CLI runs start from a server that has already imported the CLI and
+# this module, so each run skips interpreter startup and imports
+_CLI_CONTEXT = multiprocessing.get_context("forkserver")
+_CLI_CONTEXT.set_forkserver_preload(["downpore_core.aria2_client", __name__])
+
+# Tests only enqueue log records; the session listener thread writes them
+_LOG_QUEUE: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+log = logging.getLogger(__name__)
+log.addHandler(QueueHandler(_LOG_QUEUE))
+log.setLevel(logging.INFO)
+log.propagate = False
 
 
 @dataclass(frozen=True)
 class CLIResult:
-    """CLI command execution result."""
+    """CLI command execution result, with output left undecoded."""
 
     returncode: int
-    stdout: str
-    stderr: str
+    stdout: bytes
+    stderr: bytes
 
 
-class TestAria2ClientCLI:
-    """Test aria2_client.py CLI script functionality."""
+class RPCRecorder:
+    """TCP relay in front of aria2 that records what clients send it."""
+
+    def __init__(self) -> None:
+        self.port = 0
+        self.connections = 0
+        self.sent = bytearray()
+
+    def methods(self) -> List[str]:
+        """JSON-RPC method names sent so far, in order."""
+        return [m.decode() for m in RPC_METHOD_RE.findall(self.sent)]
 
-    @pytest.fixture
-    def aria2_daemon(self) -> Generator[subprocess.Popen, None, None]:
-        """Start aria2c daemon for testing."""
-        with _aria2_daemon_context() as daemon:
-            yield daemon
 
-    def test_cli_port_parameter(self, aria2_daemon: subprocess.Popen) -> None:
+class StubAria2(aria2p.Client):
+    """aria2p client answering from canned download states, without a daemon."""
+
+    def __init__(
+        self,
+        structs: Dict[str, Dict[str, Any]],
+        faults: Optional[Dict[str, Dict[str, Any]]] = None,
+    ) -> None:
+        super().__init__()
+        self.structs = structs
+        self.faults = faults or {}
+        self.calls: List[Tuple[str, List[Any]]] = []
+
+    def tell_status(self, gid: str, keys: Optional[List[str]] = None) -> dict:
+        """Return the canned status of gid."""
+        self.calls.append((self.TELL_STATUS, [gid, keys]))
+        return self.structs[gid]
+
+    def multicall2(
+        self, calls: List[Tuple[str, List[Any]]], insert_secret: bool = True
+    ) -> list:
+        """Answer each call with its canned fault or a one-element result list."""
+        self.calls.extend(calls)
+        results = []
+        for method, params in calls:
+            if method in self.faults:
+                results.append(self.faults[method])
+            elif method == self.TELL_STATUS:
+                results.append([self.structs[params[0]]])
+            else:
+                results.append([params[0]])
+        return results
+
+
+@pytest.fixture(scope="session", autouse=True)
+def log_listener() -> Generator[None, None, None]:
+    """Write queued test log records to stdout from a background thread."""
+    listener = QueueListener(_LOG_QUEUE, logging.StreamHandler(sys.stdout))
+    listener.start()
+    yield
+    listener.stop()
+
+
+@pytest.fixture(scope="session")
+def rpc_port() -> int:
+    """Unique aria2 RPC port per session so parallel workers do not collide."""
+    return _free_port()
+
+
+@pytest.fixture(scope="session")
+async def seeder() -> AsyncGenerator[Tuple[Process, Path, Path, str], None]:
+    """Generate and seed one 40MB payload for the whole test session."""
+    async with _seeder_context() as seeded:
+        yield seeded
+
+
+@pytest.fixture(scope="session")
+async def aria2_session_daemon(rpc_port: int) -> AsyncGenerator[Process, None]:
+    """Start one aria2c daemon shared by every test in the session."""
+    # Both .torrent and magnet payloads announce to the local tracker
+    async with _aria2_daemon_context(rpc_port, dht=False) as daemon:
+        yield daemon
+
+
+@pytest.fixture
+async def aria2_daemon(
+    rpc_port: int, aria2_session_daemon: Process
+) -> AsyncGenerator[Process, None]:
+    """Shared aria2c daemon, with finished downloads purged after each test."""
+    yield aria2_session_daemon
+    await asyncio.to_thread(_purge_download_results, rpc_port)
+
+
+@pytest.fixture
+async def rpc_recorder(
+    rpc_port: int, aria2_daemon: Process
+) -> AsyncGenerator[RPCRecorder, None]:
+    """Record the JSON-RPC traffic a test sends to the shared daemon."""
+    async with _rpc_recorder_context(rpc_port) as recorder:
+        yield recorder
+
+
+class TestAria2ClientCLIErrors:
+    """Test CLI error paths, which finish without downloading anything."""
+
+    async def test_cli_port_parameter(
+        self, rpc_port: int, aria2_daemon: Process
+    ) -> None:
         """Test that aria2_client.py accepts --port parameter."""
-        result = _run_cli_command(["add", "--magnet-link", "magnet:?xt=urn:btih:test"])
-        _assert_cli_failure(result, "Invalid magnet link format")
+        result = await _run_cli_command(
+            rpc_port,
+            ["add", "--magnet-link", "magnet:?xt=urn:btih:test"],
+            expected_error=INVALID_MAGNET_ERROR,
+        )
+        _assert_cli_failure(result, INVALID_MAGNET_ERROR)
+
+    async def test_cli_invalid_magnet(
+        self, rpc_port: int, aria2_daemon: Process
+    ) -> None:
+        """Test CLI handles invalid magnet links properly."""
+        result = await _run_cli_command(
+            rpc_port,
+            ["download", "--magnet-link", "invalid_magnet_link"],
+            expected_error=INVALID_MAGNET_ERROR,
+        )
+        _assert_cli_failure(result, INVALID_MAGNET_ERROR)
+
+    async def test_cli_connection_error(self) -> None:
+        """Test CLI handles connection errors properly."""
+        result = await _run_command(NO_DAEMON_CLI_CMD, timeout=10)
+        assert result.returncode != 0
+
 
-    def test_cli_torrent_file_with_local_tracker(
-        self, aria2_daemon: subprocess.Popen
+class TestAria2ClientCLI:
+    """Test aria2_client.py CLI downloads against a real seeder."""
+
+    @pytest.mark.slow
+    @pytest.mark.timeout(SLOW_TEST_TIMEOUT_SECONDS)
+    async def test_cli_torrent_file_with_local_tracker(
+        self,
+        rpc_port: int,
+        seeder: Tuple[Process, Path, Path, str],
+        rpc_recorder: RPCRecorder,
     ) -> None:
         """Test CLI download via .torrent file with local tracker."""
-        print("\n=== STARTING CLI TORRENT FILE TEST ===")
+        log.info("=== STARTING CLI TORRENT FILE TEST ===")
+        seeder_process, torrent_file, test_file, _ = seeder
 
-        with _seeder_context() as (
-            seeder_process,
-            torrent_file,
+        log.info("Test file: %s", test_file)
+        log.info("File size: %.1f MB", test_file.stat().st_size / 1024 / 1024)
+
+        await _test_download_with_seeder(
+            rpc_recorder.port,
             test_file,
-            magnet_link,
-        ):
-            print(f"Test file: {test_file}")
-            print(f"File size: {test_file.stat().st_size / 1024 / 1024:.1f} MB")
-
-            _test_download_with_seeder(
-                test_file,
-                seeder_process,
-                ["download", "--torrent-file", str(torrent_file)],
-                f"CLI torrent file: {torrent_file}",
-            )
+            seeder_process,
+            ["download", "--torrent-file", str(torrent_file)],
+            f"CLI torrent file: {torrent_file}",
+        )
 
-    def test_cli_magnet_link_with_local_tracker(self) -> None:
+        # One tellStatus per poll covers status and files; no list or per-aspect reads
+        methods = rpc_recorder.methods()
+        assert "aria2.addTorrent" in methods
+        assert not EXTRA_STATUS_RPC_METHODS.intersection(methods), methods
+
+    @pytest.mark.slow
+    @pytest.mark.timeout(SLOW_TEST_TIMEOUT_SECONDS)
+    async def test_cli_magnet_link_with_local_tracker(
+        self,
+        rpc_port: int,
+        seeder: Tuple[Process, Path, Path, str],
+        aria2_daemon: Process,
+    ) -> None:
         """Test CLI download via magnet link with local tracker."""
-        print("\n=== STARTING CLI MAGNET LINK TEST ===")
+        log.info("=== STARTING CLI MAGNET LINK TEST ===")
+        seeder_process, _, test_file, magnet_link = seeder
 
-        with _seeder_context() as (
-            seeder_process,
-            torrent_file,
+        log.info("Test file: %s", test_file)
+        log.info("File size: %.1f MB", test_file.stat().st_size / 1024 / 1024)
+
+        await _test_download_with_seeder(
+            rpc_port,
             test_file,
-            magnet_link,
-        ):
-            print(f"Test file: {test_file}")
-            print(f"File size: {test_file.stat().st_size / 1024 / 1024:.1f} MB")
-
-
-            print("Starting aria2c daemon...")
-            with _aria2_daemon_context() as aria2_process:
-                print("aria2c daemon started successfully")
-                _test_download_with_seeder(
-                    test_file,
-                    seeder_process,
-                    ["download", "--magnet-link", magnet_link],
-                    f"CLI magnet link: {magnet_link[:60]}...",
-                )
-
-    def test_cli_invalid_magnet(self, aria2_daemon: subprocess.Popen) -> None:
-        """Test CLI handles invalid magnet links properly."""
-        result = _run_cli_command(["download", "--magnet-link", "invalid_magnet_link"])
-        _assert_cli_failure(result, "Invalid magnet link format")
+            seeder_process,
+            ["download", "--magnet-link", magnet_link],
+            f"CLI magnet link: {magnet_link[:60]}...",
+        )
 
-    def test_cli_connection_error(self) -> None:
-        """Test CLI handles connection errors properly."""
-        cmd = [
-            str(Path(__file__).parent.parent / "downpore_core" / "aria2_client.py"),
-            "--port",
-            "9999",  # Port with no daemon
-            "download",
-            "--magnet-link",
-            "magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef01234567",
+    async def test_cli_keepalive(
+        self, seeder: Tuple[Process, Path, Path, str], rpc_recorder: RPCRecorder
+    ) -> None:
+        """Test CLI sends all of its JSON-RPC calls over one connection."""
+        _, torrent_file, _, _ = seeder
+        result = await _run_cli_command(
+            rpc_recorder.port, ["add", "--torrent-file", str(torrent_file)]
+        )
+        assert result.returncode == 0, result.stderr.decode()
+        assert len(rpc_recorder.methods()) > 1
+        assert rpc_recorder.connections == 1
+
+        # Don't leave the download running in the shared daemon
+        gid = orjson.loads(result.stdout)["torrent_hash"]
+        removed = await _run_cli_command(
+            rpc_recorder.port, ["remove", "--torrent-hash", gid, "--delete-files"]
+        )
+        assert removed.returncode == 0, removed.stderr.decode()
+
+
+class TestMagnetValidation:
+    """Test magnet link validation without a running daemon."""
+
+    @pytest.mark.parametrize(
+        "magnet_link, expected",
+        [
+            ("magnet:?xt=urn:btih:0123456789abcdef0123456789ABCDEF01234567", True),
+            ("magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef01234567&dn=x", True),
+            ("magnet:?xt=urn:btih:ABCDEFGHIJKLMNOPQRSTUVWXYZ234567", True),
+            ("magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef0123456g", False),
+            ("magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef012345678", False),
+            ("magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef01234567\n", False),
+            ("magnet:?xt=urn:btih:ABCDEFGHIJKLMNOPQRSTUVWXYZ234567\n", False),
+            ("magnet:?xt=urn:btih:test", False),
+            ("invalid_magnet_link", False),
+            ("", False),
+        ],
+    )
+    def test_validate_magnet_link(self, magnet_link: str, expected: bool) -> None:
+        """Test hex fast path and regex agree on valid and invalid links."""
+        assert Aria2Client()._validate_magnet_link(magnet_link) is expected
+
+
+class TestDownloadOptions:
+    """Test per-download options sent with the add call."""
+
+    def test_unset_options_leave_daemon_config(self) -> None:
+        """Test only the download directory is sent by default."""
+        assert DownloadOptions().to_aria2("/data") == {"dir": "/data"}
+
+    def test_small_swarm_options_round_trip_cli_flags(self) -> None:
+        """Test the tuned options survive the trip through CLI flags."""
+        args = parse_args(["add", *_download_option_args(SMALL_SWARM_OPTIONS)])
+        parsed = DownloadOptions(
+            **{f.name: getattr(args, f.name) for f in fields(DownloadOptions)}
+        )
+        assert parsed == SMALL_SWARM_OPTIONS
+
+
+class TestNotificationListener:
+    """Test the WebSocket notification listener without a running daemon."""
+
+    @pytest.mark.parametrize(
+        "error",
+        [
+            websocket.WebSocketBadStatusException("Handshake status %d", 400),
+            websocket.WebSocketTimeoutException("timed out"),
+            OSError("network unreachable"),
+        ],
+    )
+    def test_handshake_failure_leaves_polling(self, error: Exception) -> None:
+        """Test a failed WebSocket handshake ends the listener quietly."""
+
+        def refuse(**kwargs: object) -> None:
+            raise error
+
+        client = Aria2Client()
+        client._api = SimpleNamespace(
+            client=SimpleNamespace(listen_to_notifications=refuse)
+        )
+        client._listen_for_notifications()
+
+
+class TestRemoveAndFollow:
+    """Test magnet follow-up handling against a stubbed aria2p client."""
+
+    METADATA_GID = "0000000000000001"
+    FILES_GID = "0000000000000002"
+
+    def _client(self, stub: StubAria2) -> Aria2Client:
+        """Aria2Client wired to stub instead of a daemon.
+
+        Args:
+            stub: Stubbed aria2p client
+
+        Returns:
+            Client whose RPC calls go to stub
+        """
+        client = Aria2Client()
+        client._api = SimpleNamespace(client=stub)
+        client._start_listener = lambda: None
+        return client
+
+    def _magnet_stub(self, files_status: str, **kwargs: Any) -> StubAria2:
+        """Stub with completed magnet metadata followed by a file download.
+
+        Args:
+            files_status: Status of the follow-up file download
+            **kwargs: Extra StubAria2 arguments
+
+        Returns:
+            Stub holding both downloads
+        """
+        return StubAria2(
+            {
+                self.METADATA_GID: {
+                    "status": "complete",
+                    "followedBy": [self.FILES_GID],
+                },
+                self.FILES_GID: {"status": files_status},
+            },
+            **kwargs,
+        )
+
+    @pytest.mark.parametrize(
+        "delete_files, files_method",
+        [(False, aria2p.Client.REMOVE), (True, aria2p.Client.FORCE_REMOVE)],
+    )
+    def test_remove_follow_up_download(
+        self, delete_files: bool, files_method: str
+    ) -> None:
+        """Test removal stops the active follow-up and clears the metadata result."""
+        stub = self._magnet_stub("active")
+        client = self._client(stub)
+        client._gid_aliases[self.METADATA_GID] = self.FILES_GID
+
+        client.remove_torrent(self.METADATA_GID, delete_files=delete_files)
+
+        assert stub.calls[-2:] == [
+            (files_method, [self.FILES_GID]),
+            (aria2p.Client.REMOVE_DOWNLOAD_RESULT, [self.METADATA_GID]),
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-        assert result.returncode != 0
+        assert self.METADATA_GID not in client._gid_aliases
+
+    def test_multicall_fault_raises(self) -> None:
+        """Test a fault struct inside a multicall result is not swallowed."""
+        fault = {"code": 1, "message": "GID not found"}
+        stub = self._magnet_stub("active", faults={aria2p.Client.REMOVE: fault})
+        client = self._client(stub)
+
+        with pytest.raises(aria2p.ClientException, match="GID not found"):
+            client.remove_torrent(self.METADATA_GID)
+
+    def test_wait_follows_metadata_download(self) -> None:
+        """Test waiting switches to the follow-up GID and remembers it."""
+        stub = self._magnet_stub("complete")
+        client = self._client(stub)
 
+        assert client.wait_for_completion(self.METADATA_GID, timeout=1)
 
-def _build_aria2_command(port: int, download_dir: str) -> List[str]:
+        assert [params[0] for _, params in stub.calls] == [
+            self.METADATA_GID,
+            self.FILES_GID,
+        ]
+        assert client._gid_aliases == {self.METADATA_GID: self.FILES_GID}
+
+
+class TestPieceSize:
+    """Test torrent piece size selection for test payloads."""
+
+    @pytest.mark.parametrize(
+        "size_mb, expected",
+        [
+            (0, 32 * 1024),
+            (8, 32 * 1024),
+            (40, 32 * 1024),
+            (1000, 1024 * 1024),
+            (100000, 4 * 1024 * 1024),
+        ],
+    )
+    def test_choose_piece_size(self, size_mb: int, expected: int) -> None:
+        """Test piece size scales with content and stays within bounds."""
+        assert choose_piece_size(size_mb * 1024 * 1024) == expected
+
+
+def _build_aria2_command(
+    port: int, download_dir: str, *, dht: bool, **overrides: str
+) -> List[str]:
     """Build aria2c command with configuration.
 
     Args:
         port: RPC listen port
         download_dir: Download directory
+        dht: Enable DHT peer discovery (not needed when a tracker is announced)
+        **overrides: Extra or replacement aria2 options, underscores for dashes
 
     Returns:
         List of command arguments for subprocess
     """
-    return [
-        "aria2c",
-        "--enable-rpc",
-        f"--rpc-listen-port={port}",
-        "--dir",
-        download_dir,
-        "--seed-time=0",  # Don't seed after download
-        "--check-integrity=false",  # Speed up testing
-        "--allow-overwrite=true",
-        "--split=16",
-        "--enable-dht=true",  # Enable DHT for peer discovery
-        "--bt-tracker-timeout=5",  # Longer tracker timeout
-        "--follow-torrent=true",  # Auto start file download after metadata
-        "--bt-tracker-connect-timeout=30",  # Longer tracker connect timeout
-    ]
+    aria2c = shutil.which("aria2c")
+    if aria2c is None:
+        raise FileNotFoundError("aria2c not found on PATH")
+    options = {
+        **ARIA2_BASE_OPTIONS,
+        "rpc-listen-port": str(port),
+        "dir": download_dir,
+        "enable-dht": "true" if dht else "false",
+        **{name.replace("_", "-"): value for name, value in overrides.items()},
+    }
+    return [aria2c, *(f"--{name}={value}" for name, value in options.items())]
 
 
 # Helper functions
 
 
-def _run_cli_command(args: List[str], timeout: int = CLI_PROCESS_TIMEOUT_SECONDS) -> CLIResult:
-    """Run CLI command with common setup."""
-    cmd = CLI_BASE_CMD + args
-    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
-    return CLIResult(result.returncode, result.stdout, result.stderr)
+def _free_port() -> int:
+    """Ask the OS for a currently unused port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _run_cli_command(
+    port: int,
+    args: List[str],
+    timeout: int = CLI_PROCESS_TIMEOUT_SECONDS,
+    expected_error: Optional[str] = None,
+) -> CLIResult:
+    """Run CLI command against the aria2 daemon on port.
+
+    With expected_error, a CLI that prints it but does not exit within
+    ERROR_EXIT_GRACE_SECONDS is killed instead of running to the timeout.
+    """
+    cli_args = ("--port", str(port), *args)
+    if CLI_RUNNER == "forkserver":
+        return await asyncio.to_thread(
+            _run_cli_forked, cli_args, timeout, expected_error
+        )
+    return await _run_command((CLI_SCRIPT, *cli_args), timeout, expected_error)
+
+
+def _run_cli_forked(
+    args: Sequence[str], timeout: float, expected_error: Optional[str] = None
+) -> CLIResult:
+    """Run the CLI in a child of the preloaded forkserver, killing it on timeout.
+
+    The child streams its output back as it writes it. Once it prints
+    expected_error it gets ERROR_EXIT_GRACE_SECONDS to exit with its own
+    status; only a child still running after that is reported as -SIGKILL.
+    """
+    receiver, sender = _CLI_CONTEXT.Pipe(duplex=False)
+    process = _CLI_CONTEXT.Process(target=_cli_entry, args=(list(args), sender))
+    process.start()
+    sender.close()
+    output = {"stdout": bytearray(), "stderr": bytearray()}
+    error = expected_error.encode() if expected_error else None
+    deadline = time.monotonic() + timeout
+    matched = False
+    try:
+        while True:
+            if not receiver.poll(max(0.0, deadline - time.monotonic())):
+                if not matched:
+                    raise TimeoutError(f"CLI did not finish within {timeout} seconds")
+                # Printed the error but kept running; killed below
+                returncode = -signal.SIGKILL
+                break
+            try:
+                stream, data = receiver.recv()
+            except EOFError:
+                # Child died without reporting its status, e.g. on a signal
+                process.join()
+                returncode = process.exitcode
+                break
+            if stream == "exit":
+                returncode = data
+                break
+            output[stream] += data.encode()
+            if error and not matched and error in output[stream]:
+                matched = True
+                deadline = min(deadline, time.monotonic() + ERROR_EXIT_GRACE_SECONDS)
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+        receiver.close()
+    return CLIResult(returncode, bytes(output["stdout"]), bytes(output["stderr"]))
+
+
+class _PipeWriter(io.TextIOBase):
+    """Text stream that forwards every write over a pipe, tagged by stream."""
+
+    def __init__(self, sender: Connection, stream: str) -> None:
+        super().__init__()
+        self._sender = sender
+        self._stream = stream
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self._sender.send((self._stream, text))
+        return len(text)
+
+
+def _cli_entry(args: List[str], sender: Connection) -> None:
+    """Forkserver child: run the CLI, streaming output then its exit status."""
+    stdout, stderr = _PipeWriter(sender, "stdout"), _PipeWriter(sender, "stderr")
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        returncode = _call_cli_main(args)
+    sender.send(("exit", returncode))
+    sender.close()
+
+
+def _call_cli_main(args: Sequence[str]) -> int:
+    """Call the CLI's main() in this process, returning the script's exit status."""
+    try:
+        aria2_client_main(args)
+        return 0
+    except SystemExit as exc:
+        # argparse exits with an int status; a bare exit is success
+        return exc.code or 0
+    except Exception:
+        # Same stderr and status an uncaught error gives the script
+        traceback.print_exc()
+        return 1
+
+
+async def _run_command(
+    cmd: Sequence[str], timeout: float, expected_error: Optional[str] = None
+) -> CLIResult:
+    """Run command without blocking the event loop, killing it on timeout.
+
+    With expected_error, a process that prints it but does not exit within
+    ERROR_EXIT_GRACE_SECONDS is killed instead of running to the timeout.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=PIPE, stderr=PIPE, close_fds=SPAWN_CLOSE_FDS
+    )
+    if expected_error is None:
+        output = process.communicate()
+    else:
+        output = _read_until_error(process, expected_error.encode())
+    try:
+        stdout, stderr = await asyncio.wait_for(output, timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise
+    return CLIResult(process.returncode, stdout, stderr)
+
+
+async def _read_until_error(process: Process, error: bytes) -> Tuple[bytes, bytes]:
+    """Stream stdout and stderr; once error is printed, allow a grace period.
+
+    The process keeps its own exit status if it exits within
+    ERROR_EXIT_GRACE_SECONDS and is killed otherwise.
+    """
+    matched = asyncio.Event()
+
+    async def collect(stream: asyncio.StreamReader) -> bytes:
+        lines = []
+        async for line in stream:
+            lines.append(line)
+            if error in line:
+                matched.set()
+        return b"".join(lines)
+
+    readers = asyncio.gather(collect(process.stdout), collect(process.stderr))
+    matched_wait = asyncio.ensure_future(matched.wait())
+    await asyncio.wait({readers, matched_wait}, return_when=asyncio.FIRST_COMPLETED)
+    matched_wait.cancel()
+    if not readers.done():
+        try:
+            await asyncio.wait_for(process.wait(), ERROR_EXIT_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            with contextlib.suppress(ProcessLookupError):
+                process.kill()
+    stdout, stderr = await readers
+    await process.wait()
+    return stdout, stderr
+
+
+def _download_option_args(options: DownloadOptions) -> List[str]:
+    """CLI flags for options; each flag is named after its aria2 option."""
+    return [
+        arg
+        for name, value in options.to_aria2().items()
+        for arg in (f"--{name}", value)
+    ]
 
 
 def _assert_cli_success(result: CLIResult) -> None:
     """Assert CLI command succeeded with valid JSON output."""
-    assert result.returncode == 0, f"CLI failed: {result.stderr}"
-    output_data = json.loads(result.stdout)
-    assert output_data["success"] is True
-    assert "torrent_hash" in output_data
-    assert "files" in output_data
-    assert len(output_data["files"]) > 0
-    assert output_data["download_size"] == EXPECTED_FILE_SIZE
-    assert output_data["download_complete"] is True
+    assert result.returncode == 0, f"CLI failed: {result.stderr.decode()}"
+    # Missing keys raise KeyError from the itemgetter
+    success, _, files, download_size, complete = CLI_SUCCESS_FIELDS(
+        orjson.loads(result.stdout)
+    )
+    assert success is True and complete is True
+    assert download_size == EXPECTED_FILE_SIZE
+    assert len(files) > 0
 
 
 def _assert_cli_failure(result: CLIResult, expected_error: str) -> None:
     """Assert CLI command failed with expected error."""
     assert result.returncode != 0
-    assert expected_error in result.stderr or expected_error in result.stdout
+    expected = expected_error.encode()
+    assert expected in result.stderr or expected in result.stdout, (
+        result.stderr.decode()
+    )
 
 
-def _terminate_process(process: subprocess.Popen, timeout: int = 5) -> None:
+async def _terminate_process(process: Process, timeout: int = 5) -> None:
     """Terminate process gracefully with fallback to kill."""
     if process and process.returncode is None:
         process.terminate()
         try:
-            process.wait(timeout=timeout)
-        except subprocess.TimeoutExpired:
+            await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
             process.kill()
-            process.wait()
+            await process.wait()
 
 
-def _wait_for_process(name: str, process: subprocess.Popen, duration: int) -> None:
+async def _wait_for_process(name: str, process: Process, duration: int) -> None:
     """Wait for process to start and log status."""
-    print(f"Waiting {duration} seconds for {name} to start...")
-    time.sleep(duration)
+    log.info("Waiting %d seconds for %s to start...", duration, name)
+    await asyncio.sleep(duration)
 
-    if process.poll() is not None:
-        stdout, _ = process.communicate()
-        print(f"[{name}] Process exited. Output:")
-        print(stdout)
+    if process.returncode is not None:
+        stdout, _ = await process.communicate()
+        log.info("[%s] Process exited. Output:\n%s", name, stdout.decode())
     else:
-        print(f"[{name}] Process is still running")
+        log.info("[%s] Process is still running", name)
 
 
-@contextmanager
-def _aria2_daemon_context() -> Generator[subprocess.Popen, None, None]:
-    """Context manager for aria2c daemon."""
-    download_dir = tempfile.mkdtemp(prefix="aria2_cli_test_")
-    cmd = _build_aria2_command(TEST_PORT, download_dir)
+@asynccontextmanager
+async def _aria2_daemon_context(
+    port: int, *, dht: bool
+) -> AsyncGenerator[Process, None]:
+    """Context manager for aria2c daemon listening for RPC on port."""
+    download_dir = tempfile.mkdtemp(prefix="aria2_cli_test_", dir=TMPFS_DIR)
+    cmd = _build_aria2_command(port, download_dir, dht=dht)
 
-    print(f"Starting aria2c with command: {' '.join(cmd)}")
-    process = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    log.info("Starting aria2c with command: %s", " ".join(cmd))
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=PIPE, stderr=STDOUT, close_fds=SPAWN_CLOSE_FDS
     )
 
-    time.sleep(2)
-
-    if process.poll() is not None:
-        stdout, _ = process.communicate()
-        raise RuntimeError(f"aria2c failed to start. Output: {stdout}")
+    try:
+        await _wait_for_rpc_port(process, port)
+    except RuntimeError:
+        await _terminate_process(process)
+        _CLEANUP_POOL.submit(shutil.rmtree, download_dir, ignore_errors=True)
+        raise
 
     try:
         yield process
     finally:
-        _terminate_process(process)
-        shutil.rmtree(download_dir, ignore_errors=True)
+        await _terminate_process(process)
+        _CLEANUP_POOL.submit(shutil.rmtree, download_dir, ignore_errors=True)
 
 
-@contextmanager
-def _seeder_context() -> (
-    Generator[Tuple[subprocess.Popen, Path, Path, str], None, None]
-):
-    """Simplified seeder context manager."""
-    seeder_script = Path(__file__).parent.parent / "downpore_core" / "test_seeder.py"
+async def _wait_for_rpc_port(process: Process, port: int) -> None:
+    """Wait until aria2c accepts connections on its RPC port."""
+    for _ in range(RPC_READY_ATTEMPTS):
+        if process.returncode is not None:
+            stdout, _ = await process.communicate()
+            raise RuntimeError(f"aria2c failed to start. Output: {stdout.decode()}")
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection("127.0.0.1", port),
+                RPC_READY_INTERVAL_SECONDS,
+            )
+        except (OSError, asyncio.TimeoutError):
+            await asyncio.sleep(RPC_READY_INTERVAL_SECONDS)
+            continue
+        writer.close()
+        await writer.wait_closed()
+        return
+    raise RuntimeError(f"aria2c RPC port {port} not ready")
 
-    process = subprocess.Popen(
-        [
-            "python",
-            str(seeder_script),
-            "--size",
-            "40",
-            "--duration",
-            "300",
-            "--keep-files",
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
+
+def _purge_download_results(port: int) -> None:
+    """Drop finished downloads so the shared daemon starts each test clean."""
+    aria2p.Client(host="http://127.0.0.1", port=port).purge_download_result()
+
+
+@asynccontextmanager
+async def _rpc_recorder_context(
+    upstream_port: int,
+) -> AsyncGenerator[RPCRecorder, None]:
+    """Relay a free local port to upstream_port, recording client bytes.
+
+    A raw TCP relay rather than an HTTP proxy, so aria2's WebSocket
+    notifications pass through untouched.
+    """
+    recorder = RPCRecorder()
+
+    async def relay(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        recorder.connections += 1
+        upstream_reader, upstream_writer = await asyncio.open_connection(
+            "127.0.0.1", upstream_port
+        )
+        await asyncio.gather(
+            _pipe(reader, upstream_writer, recorder.sent),
+            _pipe(upstream_reader, writer, None),
+        )
+
+    server = await asyncio.start_server(relay, "127.0.0.1", 0)
+    recorder.port = server.sockets[0].getsockname()[1]
+    async with server:
+        yield recorder
+
+
+async def _pipe(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    record: Optional[bytearray],
+) -> None:
+    """Copy reader to writer until EOF, appending the bytes to record."""
+    try:
+        while data := await reader.read(65536):
+            if record is not None:
+                record += data
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+@asynccontextmanager
+async def _seeder_context() -> AsyncGenerator[Tuple[Process, Path, Path, str], None]:
+    """Simplified seeder context manager."""
+    # Unbuffered (-u) so readiness lines arrive as soon as they are printed
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-u",
+        SEEDER_SCRIPT,
+        "--size",
+        "40",
+        "--duration",
+        "300",
+        "--port",
+        str(_free_port()),
+        "--tracker-port",
+        str(_free_port()),
+        "--keep-files",
+        stdout=PIPE,
+        stderr=STDOUT,
+        env={**os.environ, "TMPDIR": TMPFS_DIR} if TMPFS_DIR else None,
+        close_fds=SPAWN_CLOSE_FDS,
     )
 
-    # Wait for files to be created
-    test_file, torrent_file = None, None
-    for _ in range(SEEDER_READY_TIMEOUT_SECONDS):
-        time.sleep(1)
-
-        if process.poll() is not None:
-            stdout, _ = process.communicate()
-            raise RuntimeError(f"test_seeder failed. Output: {stdout}")
-
-        temp_dirs = list(Path(tempfile.gettempdir()).glob("torrentp_test_*"))
-        if temp_dirs:
-            test_dir = sorted(temp_dirs, key=lambda p: p.stat().st_mtime)[-1]
-            test_file = test_dir / "test_file_40mb.bin"
-            torrent_file = test_dir / "test_file_40mb.torrent"
-
-            if test_file.exists() and torrent_file.exists():
-                torrent = torf.Torrent.read(torrent_file)
-                magnet_link = str(torrent.magnet())
-                print(
-                    f"Seeder ready: {test_file} ({test_file.stat().st_size / 1024 / 1024:.1f} MB)"
-                )
-                break
-    else:
-        _terminate_process(process)
-        raise RuntimeError(f"Seeder files not created within {SEEDER_READY_TIMEOUT_SECONDS} seconds")
+    try:
+        seeder_fields = await asyncio.wait_for(
+            _read_seeder_output(process), SEEDER_READY_TIMEOUT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        await _terminate_process(process)
+        raise RuntimeError(
+            f"Seeder not ready within {SEEDER_READY_TIMEOUT_SECONDS} seconds"
+        )
+
+    test_file = Path(seeder_fields["File"])
+    torrent_file = Path(seeder_fields["Torrent"])
+    magnet_link = seeder_fields["Magnet"]
+    log.info(
+        "Seeder ready: %s (%.1f MB)", test_file, test_file.stat().st_size / 1024 / 1024
+    )
 
     try:
         yield process, torrent_file, test_file, magnet_link
     finally:
-        _terminate_process(process)
-        if test_file and test_file.exists():
-            temp_dir = test_file.parent
-            if temp_dir.exists() and "torrentp_test_" in temp_dir.name:
-                shutil.rmtree(temp_dir, ignore_errors=True)
+        await _terminate_process(process)
+        temp_dir = test_file.parent
+        # Name check needs no syscall; rmtree already tolerates a missing dir
+        if TEMP_DIR_PREFIX in temp_dir.name:
+            _CLEANUP_POOL.submit(shutil.rmtree, temp_dir, ignore_errors=True)
 
 
-def _test_download_with_seeder(
+async def _read_seeder_output(process: Process) -> Dict[str, str]:
+    """Read seeder output until it starts seeding.
+
+    Returns:
+        The "Key: value" lines the seeder printed, e.g. File, Torrent, Magnet
+    """
+    seeder_fields: Dict[str, str] = {}
+    output: List[str] = []
+
+    while True:
+        line = (await process.stdout.readline()).decode()
+        if not line:
+            await process.wait()
+            raise RuntimeError(f"test_seeder failed. Output: {''.join(output)}")
+
+        output.append(line)
+        if line.startswith(SEEDER_READY_LINE):
+            return seeder_fields
+
+        key, separator, value = line.rstrip("\n").partition(": ")
+        if separator:
+            seeder_fields[key] = value
+
+
+async def _test_download_with_seeder(
+    port: int,
     test_file: Path,
-    seeder_process: subprocess.Popen,
+    seeder_process: Process,
     cli_args: List[str],
     description: str,
 ) -> None:
     """Test CLI download with running seeder."""
-    if seeder_process.poll() is not None:
-        stdout, _ = seeder_process.communicate()
+    if seeder_process.returncode is not None:
+        stdout, _ = await seeder_process.communicate()
         pytest.fail(
-            f"Seeder died early. Code: {seeder_process.returncode}. Output: {stdout}"
+            f"Seeder died early. Code: {seeder_process.returncode}. Output: {stdout.decode()}"
         )
 
-    print(f"Starting CLI download via {description}")
+    log.info("Starting CLI download via %s", description)
 
-    cmd_args = cli_args + ["--timeout", str(DEFAULT_CLI_TIMEOUT_SECONDS)]
-    result = _run_cli_command(cmd_args)
+    cmd_args = [
+        *cli_args,
+        *_download_option_args(SMALL_SWARM_OPTIONS),
+        "--timeout",
+        str(DEFAULT_CLI_TIMEOUT_SECONDS),
+    ]
+    result = await _run_cli_command(port, cmd_args)
 
-    print(f"CLI return code: {result.returncode}")
-    print(f"CLI stdout: {result.stdout}")
-    print(f"CLI stderr: {result.stderr}")
+    log.info("CLI return code: %d", result.returncode)
+    log.info("CLI stdout: %s", result.stdout.decode())
+    log.info("CLI stderr: %s", result.stderr.decode())
 
     _assert_cli_success(result)
-    print("CLI download completed successfully!")
+    log.info("CLI download completed successfully!")
 
 
 if __name__ == "__main__":